@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Script to generate customer profiles using OpenAI GPT-4.
+Script to generate customer profiles using OpenAI chat models.
 Reads customer data from nudge_customers.xlsx and profile data from profile_book.pdf,
 then generates detailed profiles for each customer.
 """
@@ -9,11 +9,77 @@ import os
 import sys
 import time
 import re
-from typing import List, Dict, Optional
-import PyPDF2
+import asyncio
+import argparse
+import json
+import tempfile
+import glob
+import random
+import functools
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, TextIO, Tuple
+import ahocorasick
+import Levenshtein
+from rapidfuzz import fuzz, process
+import pypdfium2 as pdfium
+import orjson
 import openpyxl
-from openai import OpenAI
-import os
+from openpyxl.worksheet.worksheet import Worksheet
+import openai
+import tiktoken
+from openai import AsyncOpenAI
+
+# Chat model used for profile generation (override via environment)
+PROFILE_MODEL = os.getenv('PROFILE_MODEL', 'gpt-4o-mini')
+
+# Concurrency and rate limits for OpenAI calls (override via environment)
+PROFILE_CONCURRENCY = int(os.getenv('PROFILE_CONCURRENCY', '8'))
+PROFILE_RPM = int(os.getenv('PROFILE_RPM', '500'))
+PROFILE_TPM = int(os.getenv('PROFILE_TPM', '200000'))
+
+# Retry rate-limited, server and connection errors with exponential backoff
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2.0
+
+# Generated profiles are appended here as they complete so a crashed run can resume
+CHECKPOINT_FILE = 'profiles.jsonl'
+
+# Profile books with at least this many pages are extracted across worker processes
+PARALLEL_PDF_PAGE_THRESHOLD = 50
+
+# Seconds between status checks while waiting on a Batch API job
+BATCH_POLL_INTERVAL = 30
+
+# Id of a submitted Batch API job, kept until its results are ingested so an interrupted run can resume it
+BATCH_STATE_FILE = 'profiles.batch.json'
+
+# Keywords that mark a profile book passage as relevant, compiled once
+RELEVANCE_RE = re.compile(r"education|experience|work|position|company", re.IGNORECASE)
+
+# A single name token, allowing hyphenated and apostrophe names
+NAME_TOKEN_RE = re.compile(r"[^\W\d_]+(?:['\-][^\W\d_]+)*")
+
+# Instructions shared by every profile request, sent ahead of the customer details
+PROFILE_INSTRUCTIONS = """You are an expert customer analytics specialist who creates detailed, realistic customer profiles.
+
+Based on the customer information provided, create a detailed customer profile for that person.
+
+Generate a comprehensive customer profile that includes:
+
+1. **Demographics & Location**: Based on the city they live in
+2. **Purchasing Habits**: Create realistic shopping patterns and preferences
+3. **Interests & Lifestyle**: Infer interests based on available information and city demographics
+4. **Financial Profile**: Generate a realistic credit score (300-850) and spending capacity
+5. **Brand Preferences**: Suggest likely brand affinities
+6. **Shopping Behavior**: Online vs in-store preferences, seasonal patterns
+7. **Communication Preferences**: Preferred channels and messaging style
+
+Make the profile realistic and detailed (2-3 paragraphs), incorporating any professional background or education information from the profile book data if available. If no specific data is available for this person, create a believable profile based on demographic patterns for someone in their city.
+
+Include a credit score at the end in this format: "Credit Score: XXX"
+
+Respond with just the profile text, no additional formatting or headers."""
 
 def load_openai_key() -> str:
     """Load OpenAI API key from environment variable."""
@@ -23,129 +89,499 @@ def load_openai_key() -> str:
         sys.exit(1)
     return api_key
 
+def pdf_text_cache_path(pdf_path: str) -> str:
+    """Return the sidecar cache path for a PDF, keyed by its mtime, size and extraction backend."""
+    stat = os.stat(pdf_path)
+    directory, filename = os.path.split(os.path.abspath(pdf_path))
+    return os.path.join(directory, f".{filename}.pdfium-{stat.st_mtime_ns:x}-{stat.st_size:x}.txt")
+
+def write_pdf_text_cache(pdf_path: str, cache_path: str, text: str):
+    """
+    Atomically write extracted PDF text so an interrupted run never leaves a partial cache.
+    Caches left over from earlier versions of the PDF are removed.
+    """
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+        # newline='' keeps pdfium's \r\n line breaks so cached text matches freshly extracted text
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as tmp_file:
+            tmp_file.write(text)
+        os.replace(tmp_path, cache_path)
+        tmp_path = None
+        
+        directory, filename = os.path.split(os.path.abspath(pdf_path))
+        for stale_path in glob.glob(os.path.join(glob.escape(directory), f".{glob.escape(filename)}.pdfium-*.txt")):
+            if stale_path != cache_path:
+                os.remove(stale_path)
+    except OSError as e:
+        print(f"Warning: could not cache PDF text: {e}")
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def extract_page_range(args: Tuple[str, int, int]) -> List[str]:
+    """Extract the text of pages [start, stop) from a PDF. Runs in worker processes for large books."""
+    pdf_path, start, stop = args
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        parts = []
+        for index in range(start, stop):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return parts
+    finally:
+        pdf.close()
+
 def extract_pdf_text(pdf_path: str) -> str:
-    """Extract text from PDF file."""
+    """Extract text from PDF file, reusing a cached copy if the PDF is unchanged."""
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ''
-            for page in pdf_reader.pages:
-                text += page.extract_text() + '\n'
+        cache_path = pdf_text_cache_path(pdf_path)
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8', newline='') as cache_file:
+                return cache_file.read()
+        
+        pdf = pdfium.PdfDocument(pdf_path)
+        page_count = len(pdf)
+        pdf.close()
+        
+        if page_count < PARALLEL_PDF_PAGE_THRESHOLD:
+            parts = extract_page_range((pdf_path, 0, page_count))
+        else:
+            # Split the pages into one contiguous range per worker; each worker opens the PDF once
+            workers = os.cpu_count() or 1
+            chunk_size = math.ceil(page_count / workers)
+            ranges = [(pdf_path, start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parts = [page_text for chunk in executor.map(extract_page_range, ranges) for page_text in chunk]
+        text = '\n'.join(parts)
+        
+        write_pdf_text_cache(pdf_path, cache_path, text)
         return text
     except Exception as e:
         print(f"Error reading PDF: {e}")
         sys.exit(1)
 
-def find_person_in_profile_book(first_name: str, last_name: str, profile_text: str) -> str:
+class RateLimiter:
+    """Token buckets that keep requests and tokens under their per-minute budgets."""
+
+    def __init__(self, max_requests_per_minute: int, max_tokens_per_minute: int):
+        self.max_requests = max_requests_per_minute
+        self.max_tokens = max_tokens_per_minute
+        self.available_requests = float(max_requests_per_minute)
+        self.available_tokens = float(max_tokens_per_minute)
+        self.last_update = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int):
+        # A single request larger than the whole budget would otherwise wait forever
+        tokens = min(tokens, self.max_tokens)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                elapsed = now - self.last_update
+                self.available_requests = min(self.max_requests, self.available_requests + elapsed * self.max_requests / 60.0)
+                self.available_tokens = min(self.max_tokens, self.available_tokens + elapsed * self.max_tokens / 60.0)
+                self.last_update = now
+                if self.available_requests >= 1 and self.available_tokens >= tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= tokens
+                    return
+                await asyncio.sleep(max(
+                    (1 - self.available_requests) * 60.0 / self.max_requests,
+                    (tokens - self.available_tokens) * 60.0 / self.max_tokens
+                ))
+
+def name_variations(first_name: str, last_name: str) -> List[List[str]]:
     """
-    Search for a person's profile in the profile book text.
-    Returns the relevant section of text for that person.
-    """
-    # Try different variations of the name
-    name_variations = [
-        f"{first_name} {last_name}",
-        f"{first_name.upper()} {last_name.upper()}",
-        f"{last_name}, {first_name}",
-        f"{last_name.upper()}, {first_name.upper()}",
-        first_name,
-        last_name
+    Return the lowercased name forms searched for in the profile book, in order of preference.
+    The full name in either order comes first; first or last name alone is only a fallback.
+    """
+    first_name = first_name.strip()
+    last_name = last_name.strip()
+    full_names = [f"{first_name} {last_name}", f"{last_name}, {first_name}"] if first_name and last_name else []
+    groups = [
+        full_names,
+        [name for name in (first_name, last_name) if name]
     ]
+    return [[variation.lower() for variation in group] for group in groups]
+
+def lowercase_text(text: str) -> str:
+    """Lowercase text while keeping offsets aligned with the original, for characters that lowercase to more than one."""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+def find_name_hits(customers: List[Dict], profile_text_lower: str) -> Dict[str, List[int]]:
+    """
+    Find every customer name variation in the lowercased profile book in a single Aho-Corasick pass.
+    Returns the start offsets of whole-word matches keyed by lowercased variation.
+    """
+    automaton = ahocorasick.Automaton()
+    for customer in customers:
+        if customer.get('profile'):
+            continue
+        for group in name_variations(customer.get('first_name') or '', customer.get('last_name') or ''):
+            for variation in group:
+                automaton.add_word(variation, variation)
+    
+    hits: Dict[str, List[int]] = {}
+    if len(automaton) == 0:
+        return hits
+    automaton.make_automaton()
+    
+    for end, variation in automaton.iter(profile_text_lower):
+        start = end - len(variation) + 1
+        # Only keep whole-word matches
+        if start > 0 and profile_text_lower[start - 1].isalnum():
+            continue
+        if end + 1 < len(profile_text_lower) and profile_text_lower[end + 1].isalnum():
+            continue
+        hits.setdefault(variation, []).append(start)
+    
+    return hits
+
+def sort_name_tokens(name: str) -> str:
+    """Normalize a name for screening so "smith john" and "john smith" compare equal."""
+    return ' '.join(sorted(name.lower().replace(',', ' ').split()))
+
+def fallback_candidates(profile_text_lower: str, start: int, variation: str, first_name: str, last_name: str) -> List[str]:
+    """
+    Build the full names written around a first- or last-name-only hit.
+    Only names whose other part is within one edit of the customer's are returned,
+    so a bare "smith" hit never stands in for a different Smith.
+    """
+    if not first_name or not last_name:
+        # Only one name is known, so there is no other part to check
+        return [variation]
+    
+    end = start + len(variation)
+    first_count = len(first_name.split())
+    last_count = len(last_name.split())
+    names = []  # (other part as written, expected other part, candidate full name)
+    
+    if variation == first_name:
+        # "First Last": the last name follows the hit
+        after = ' '.join(NAME_TOKEN_RE.findall(profile_text_lower, end, end + 100)[:last_count])
+        names.append((after, last_name, f"{variation} {after}"))
+    if variation == last_name:
+        # "First Last": the first name precedes the hit
+        before = ' '.join(NAME_TOKEN_RE.findall(profile_text_lower, max(0, start - 100), start)[-first_count:])
+        names.append((before, first_name, f"{before} {variation}"))
+        # "Last, First": the first name follows a comma
+        if profile_text_lower.startswith(',', end):
+            after = ' '.join(NAME_TOKEN_RE.findall(profile_text_lower, end, end + 100)[:first_count])
+            names.append((after, first_name, f"{variation} {after}"))
+    
+    return [candidate for other, expected, candidate in names
+            if other and Levenshtein.distance(other, expected, score_cutoff=1) <= 1]
+
+def find_person_in_profile_book(first_name: str, last_name: str, profile_text: str, profile_text_lower: str,
+                                name_hits: Dict[str, List[int]]) -> str:
+    """
+    Search for a person's profile in the profile book text.
+    Returns the relevant section of text for that person, or an empty string if not found.
+    """
+    first_name = (first_name or '').strip().lower()
+    last_name = (last_name or '').strip().lower()
+    
+    # Compare hits against the full name in either order
+    full_names = [f"{first_name} {last_name}".strip(), f"{last_name} {first_name}".strip()]
+    word_count = len(full_names[0].split())
+    max_distance = max(len(full_names[0]) // 2, 2)
+    
+    # Group hits by the name as written there
+    full_name_variations, single_name_variations = name_variations(first_name, last_name)
+    hits_by_candidate: Dict[str, List[int]] = {}
+    for variation in full_name_variations:
+        for start in name_hits.get(variation, []):
+            candidate = ' '.join(NAME_TOKEN_RE.findall(profile_text_lower, start, start + 100)[:word_count])
+            hits_by_candidate.setdefault(candidate, []).append(start)
+    
+    # Single-name hits are only used when the full name appears nowhere
+    if not hits_by_candidate:
+        for variation in single_name_variations:
+            for start in name_hits.get(variation, []):
+                for candidate in fallback_candidates(profile_text_lower, start, variation, first_name, last_name):
+                    hits_by_candidate.setdefault(candidate, []).append(start)
+    
+    # Cheap partial-ratio screen first, so only the closest few names get exact scoring
+    top_candidates = process.extract(full_names[0], list(hits_by_candidate), scorer=fuzz.partial_ratio,
+                                     processor=sort_name_tokens, limit=3)
     
     best_match = ""
-    best_score = 0
+    best_score = None
     
-    for name_var in name_variations:
-        if name_var.lower() in profile_text.lower():
-            # Find the context around the name
-            pattern = re.compile(rf"(.{{0,500}}){re.escape(name_var)}(.{{0,1000}})", re.IGNORECASE | re.DOTALL)
-            matches = pattern.findall(profile_text)
+    for candidate, _, _ in top_candidates:
+        # Bounded distance stops early once the cutoff is exceeded
+        distance = min(Levenshtein.distance(name, candidate, score_cutoff=max_distance) for name in full_names)
+        if distance > max_distance:
+            continue
+        similarity = max(Levenshtein.ratio(name, candidate) for name in full_names)
+        
+        for start in hits_by_candidate[candidate]:
+            # Take the context around the name
+            context = profile_text[max(0, start - 500):start + len(candidate) + 1000]
+            # Score on name similarity, then relevance indicators and length
+            score = (similarity, bool(RELEVANCE_RE.search(context)), len(context))
             
-            for before, after in matches:
-                context = before + name_var + after
-                # Score based on length and relevance indicators
-                score = len(context)
-                if any(keyword in context.lower() for keyword in ['education', 'experience', 'work', 'position', 'company']):
-                    score += 200
-                
-                if score > best_score:
-                    best_score = score
-                    best_match = context
+            if best_score is None or score > best_score:
+                best_score = score
+                best_match = context
     
-    return best_match.strip() if best_match else f"No specific profile found for {first_name} {last_name} in the profile book."
+    return best_match.strip()
 
-def generate_customer_profile(client: OpenAI, first_name: str, last_name: str, city: str, profile_book_data: str) -> str:
-    """Generate a customer profile using OpenAI."""
-    
-    prompt = f"""
-You are a customer analytics expert. Based on the following information, create a detailed customer profile for {first_name} {last_name} who lives in {city}.
+def build_profile_request(first_name: str, last_name: str, city: str, profile_book_data: str,
+                          model: str = PROFILE_MODEL) -> Dict:
+    """
+    Build the chat completion request body for a customer profile.
+    The shared instructions come first and only the customer's details vary at the end,
+    so OpenAI's prompt caching can reuse the common prefix across customers.
+    """
+    prompt = f"""Customer: {first_name} {last_name}
+City: {city}
 
 Profile Book Data (if available):
-{profile_book_data}
+{profile_book_data}"""
 
-Generate a comprehensive customer profile that includes:
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": PROFILE_INSTRUCTIONS},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 500,
+        "temperature": 0.7,
+        "user": "generate_profiles"
+    }
 
-1. **Demographics & Location**: Based on living in {city}
-2. **Purchasing Habits**: Create realistic shopping patterns and preferences
-3. **Interests & Lifestyle**: Infer interests based on available information and city demographics
-4. **Financial Profile**: Generate a realistic credit score (300-850) and spending capacity
-5. **Brand Preferences**: Suggest likely brand affinities
-6. **Shopping Behavior**: Online vs in-store preferences, seasonal patterns
-7. **Communication Preferences**: Preferred channels and messaging style
-
-Make the profile realistic and detailed (2-3 paragraphs), incorporating any professional background or education information from the profile book data if available. If no specific data is available for this person, create a believable profile based on demographic patterns for someone in {city}.
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """Return the tokenizer for a model, falling back to cl100k_base for unknown models."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
 
-Include a credit score at the end in this format: "Credit Score: XXX"
+def estimate_request_tokens(request: Dict) -> int:
+    """Estimate the tokens a request counts against the TPM limit: prompt plus max completion."""
+    encoding = get_encoding(request["model"])
+    prompt_tokens = sum(len(encoding.encode(message["content"])) + 4 for message in request["messages"])
+    return prompt_tokens + request.get("max_tokens", 0)
 
-Respond with just the profile text, no additional formatting or headers.
-"""
+async def generate_customer_profile(client: AsyncOpenAI, request: Dict) -> str:
+    """Generate a customer profile using OpenAI. Raises on API errors."""
+    response = await client.chat.completions.create(**request)
+    
+    return response.choices[0].message.content.strip()
 
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Return the delay requested by the server's Retry-After header, if the error carries one."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    retry_after = response.headers.get('retry-after')
+    if retry_after is None:
+        return None
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an expert customer analytics specialist who creates detailed, realistic customer profiles."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content.strip()
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        return None
+
+async def generate_with_retries(client: AsyncOpenAI, semaphore: asyncio.Semaphore, limiter: RateLimiter, request: Dict) -> str:
+    """
+    Generate a profile within the concurrency and rate limits.
+    Retries rate-limit, server and connection errors with exponential backoff,
+    honouring the server's Retry-After header when it sends one.
+    The client should have SDK retries disabled so every attempt goes through the rate limiter.
+    """
+    tokens = estimate_request_tokens(request)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        async with semaphore:
+            await limiter.acquire(tokens)
+            try:
+                return await generate_customer_profile(client, request)
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                error = e
         
-    except Exception as e:
-        print(f"Error generating profile for {first_name} {last_name}: {e}")
-        return f"Error generating profile: {str(e)}"
+        # Back off outside the semaphore so other requests can proceed
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = RETRY_BASE_DELAY * 2 ** (attempt - 1) + random.uniform(0, 1)
+        print(f"  Attempt {attempt}/{MAX_ATTEMPTS} failed ({error}), retrying in {delay:.1f}s...")
+        await asyncio.sleep(delay)
+
+def load_batch_state(file_path: str) -> Optional[Dict]:
+    """Load the id and row keys of a Batch API job submitted by an earlier run, if any."""
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        return {"batch_id": state["batch_id"], "keys": state["keys"]}
+    except (OSError, json.JSONDecodeError, KeyError, TypeError) as e:
+        print(f"Warning: ignoring unreadable batch state {file_path}: {e}")
+        return None
+
+def parse_batch_results(text: str, profiles: Dict[str, str], errors: Dict[str, str]):
+    """Parse a Batch API output or error file into profiles and errors keyed by custom_id."""
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            error = record.get('error') or (response.get('body') or {}).get('error')
+            errors[record['custom_id']] = str(error)
+            continue
+        profiles[record['custom_id']] = response['body']['choices'][0]['message']['content'].strip()
+
+async def collect_profile_batch(client: AsyncOpenAI, batch, keys: Dict[str, Tuple]) -> Tuple[Dict[Tuple, str], Dict[Tuple, str]]:
+    """
+    Poll a Batch API job until it finishes and return (profiles, errors) keyed by checkpoint key.
+    The saved batch state is removed once the results have been read.
+    """
+    # Poll until the batch reaches a terminal state
+    while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        if counts:
+            print(f"  Batch {batch.status}: {counts.completed}/{counts.total} completed, {counts.failed} failed")
+        else:
+            print(f"  Batch {batch.status}")
+    
+    if batch.status != 'completed':
+        print(f"Error: batch {batch.id} finished with status {batch.status}")
+    
+    # Successful requests land in the output file, failed ones in the error file
+    profiles: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            content = await client.files.content(file_id)
+            parse_batch_results(content.text, profiles, errors)
+    os.remove(BATCH_STATE_FILE)
+    
+    # Join results back on custom_id
+    return (
+        {tuple(keys[custom_id]): profile for custom_id, profile in profiles.items() if custom_id in keys},
+        {tuple(keys[custom_id]): error for custom_id, error in errors.items() if custom_id in keys}
+    )
+
+async def run_profile_batch(client: AsyncOpenAI, requests: Dict[str, Dict],
+                            keys: Dict[str, Tuple[str, str, str]]) -> Tuple[Dict[Tuple, str], Dict[Tuple, str]]:
+    """
+    Submit chat completion requests through the OpenAI Batch API.
+    Takes request bodies and checkpoint keys, both keyed by custom_id, and returns (profiles, errors)
+    keyed by checkpoint key. A job left running by an interrupted run is resumed instead of resubmitted;
+    requests it does not cover are submitted as a new job afterwards.
+    """
+    profiles: Dict[Tuple, str] = {}
+    errors: Dict[Tuple, str] = {}
+    
+    state = load_batch_state(BATCH_STATE_FILE)
+    if state:
+        try:
+            batch = await client.batches.retrieve(state["batch_id"])
+        except openai.APIError as e:
+            # Unknown, expired or inaccessible job: forget it and submit everything afresh
+            print(f"Warning: could not resume batch {state['batch_id']}, submitting a new one: {e}")
+            os.remove(BATCH_STATE_FILE)
+        else:
+            print(f"Resuming batch {batch.id} with {len(state['keys'])} requests")
+            profiles, errors = await collect_profile_batch(client, batch, state["keys"])
+            
+            # Only requests the resumed job did not cover still need submitting
+            covered = {tuple(key) for key in state["keys"].values()}
+            requests = {custom_id: body for custom_id, body in requests.items() if tuple(keys[custom_id]) not in covered}
+            if requests:
+                print(f"{len(requests)} pending requests were not in the resumed batch")
+    
+    if not requests:
+        return profiles, errors
+    
+    lines = [
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+        for custom_id, body in requests.items()
+    ]
+    payload = ('\n'.join(lines) + '\n').encode('utf-8')
+    
+    batch_file = await client.files.create(file=('profile_requests.jsonl', payload), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    # Remember the job so a crash while polling does not pay for it twice
+    submitted_keys = {custom_id: keys[custom_id] for custom_id in requests}
+    with open(BATCH_STATE_FILE, 'w', encoding='utf-8') as file:
+        json.dump({"batch_id": batch.id, "keys": submitted_keys}, file)
+    print(f"Submitted batch {batch.id} with {len(requests)} requests")
+    
+    new_profiles, new_errors = await collect_profile_batch(client, batch, submitted_keys)
+    profiles.update(new_profiles)
+    errors.update(new_errors)
+    return profiles, errors
+
+def checkpoint_key(customer: Dict) -> Tuple[str, str, str]:
+    """Identify a customer across runs by first name, last name and city."""
+    return (str(customer.get('first_name') or ''), str(customer.get('last_name') or ''), str(customer.get('city') or ''))
+
+def load_profile_checkpoint(file_path: str) -> Dict[Tuple[str, str, str], str]:
+    """Load profiles saved by previous runs, skipping partially written or unrecognised lines."""
+    profiles = {}
+    if not os.path.exists(file_path):
+        return profiles
+    
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+                profiles[tuple(record['key'])] = record['profile']
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+    return profiles
 
-def load_customers_from_excel(file_path: str) -> List[Dict]:
-    """Load customer data from Excel file."""
+def save_profile_checkpoint(checkpoint: TextIO, customer: Dict):
+    """Append a generated profile to the checkpoint file and flush it to disk."""
+    checkpoint.write(json.dumps({"key": list(checkpoint_key(customer)), "profile": customer['profile']}) + '\n')
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+
+def load_customers_from_excel(file_path: str, read_only: bool = False) -> Tuple[List[Dict], openpyxl.Workbook, Worksheet, Tuple]:
+    """
+    Load customer data from Excel file.
+    Returns the customers along with the open workbook, sheet and headers so profiles can be written back without reloading.
+    With read_only=True the faster read-only parser is used, formula cells yield their cached values,
+    and the returned workbook cannot be saved.
+    """
     try:
-        wb = openpyxl.load_workbook(file_path)
+        # data_only is only safe when the workbook is never saved, as saving would replace formulas with values
+        wb = openpyxl.load_workbook(file_path, read_only=read_only, data_only=read_only)
         sheet = wb.active
         
-        customers = []
-        headers = [cell.value for cell in sheet[1]]
-        
-        for row_num in range(2, sheet.max_row + 1):
-            row_data = {}
-            for col_num, header in enumerate(headers, 1):
-                cell_value = sheet.cell(row=row_num, column=col_num).value
-                row_data[header] = cell_value
-            customers.append(row_data)
+        rows = sheet.iter_rows(values_only=True)
+        headers = next(rows)
+        customers = [dict(zip(headers, row)) for row in rows]
+        if read_only:
+            wb.close()
         
-        return customers
+        return customers, wb, sheet, headers
         
     except Exception as e:
         print(f"Error loading Excel file: {e}")
         sys.exit(1)
 
-def update_excel_with_profiles(file_path: str, customers: List[Dict]):
-    """Update Excel file with generated profiles."""
+def update_excel_with_profiles(wb: openpyxl.Workbook, sheet: Worksheet, headers: Tuple, customers: List[Dict], file_path: str) -> bool:
+    """Update Excel file with generated profiles. Returns True once the file has been saved."""
     try:
-        wb = openpyxl.load_workbook(file_path)
-        sheet = wb.active
-        
         # Find the profile column index
-        headers = [cell.value for cell in sheet[1]]
         profile_col_index = headers.index('profile') + 1
         
         # Update each row with the profile
@@ -156,57 +592,167 @@ def update_excel_with_profiles(file_path: str, customers: List[Dict]):
         # Save the file
         wb.save(file_path)
         print(f"Successfully updated {file_path} with generated profiles!")
+        return True
         
     except Exception as e:
         print(f"Error updating Excel file: {e}")
+        return False
+
+def write_customers_jsonl(file_path: str, customers: List[Dict]) -> bool:
+    """
+    Write customers, including generated profiles, as one JSON object per line.
+    Every line is serialized before the file is replaced, so a failure never leaves a partial file.
+    Returns True once the file has been written.
+    """
+    tmp_path = None
+    try:
+        lines = [orjson.dumps(customer, option=orjson.OPT_NON_STR_KEYS) + b'\n' for customer in customers]
+        
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.writelines(lines)
+        os.replace(tmp_path, file_path)
+        tmp_path = None
+        print(f"Successfully wrote {len(customers)} customers to {file_path}!")
+        return True
+        
+    except Exception as e:
+        print(f"Error writing JSONL file: {e}")
+        return False
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-def main():
+async def main(args: argparse.Namespace):
     """Main function to process all customers and generate profiles."""
     print("Starting customer profile generation...")
     
     # Initialize OpenAI client
     api_key = load_openai_key()
-    client = OpenAI(api_key=api_key)
+    client = AsyncOpenAI(api_key=api_key)
+    # Profile requests are retried by generate_with_retries so every attempt goes through the rate limiter
+    no_retry_client = client.with_options(max_retries=0)
     
     # Load profile book data
     print("Loading profile book data...")
     profile_book_text = extract_pdf_text('profile_book.pdf')
+    profile_book_text_lower = lowercase_text(profile_book_text)
     
     # Load customers from Excel
     print("Loading customer data...")
-    customers = load_customers_from_excel('nudge_customers.xlsx')
+    # The workbook is only saved back when not exporting to JSONL
+    customers, wb, sheet, headers = load_customers_from_excel('nudge_customers.xlsx', read_only=bool(args.jsonl_out))
     print(f"Found {len(customers)} customers to process")
     
-    # Generate profiles for each customer
-    for i, customer in enumerate(customers, 1):
+    # Resume from profiles checkpointed by an earlier, interrupted run
+    if args.fresh and os.path.exists(CHECKPOINT_FILE):
+        print(f"Discarding checkpointed profiles in {CHECKPOINT_FILE}")
+        os.remove(CHECKPOINT_FILE)
+    saved_profiles = load_profile_checkpoint(CHECKPOINT_FILE)
+    restored = 0
+    for customer in customers:
+        if not customer.get('profile') and checkpoint_key(customer) in saved_profiles:
+            customer['profile'] = saved_profiles[checkpoint_key(customer)]
+            restored += 1
+    if restored:
+        print(f"Restored {restored} profiles from {CHECKPOINT_FILE}")
+    
+    # Locate every customer's name in the profile book in one pass
+    name_hits = find_name_hits(customers, profile_book_text_lower)
+    
+    # Bound in-flight requests and keep them under the RPM and TPM budgets
+    semaphore = asyncio.Semaphore(PROFILE_CONCURRENCY)
+    limiter = RateLimiter(PROFILE_RPM, PROFILE_TPM)
+    
+    async def bounded(i: int, customer: Dict):
         first_name = customer.get('first_name', '')
         last_name = customer.get('last_name', '')
         city = customer.get('city', '')
         
-        print(f"Processing {i}/{len(customers)}: {first_name} {last_name} from {city}")
-        
         # Skip if profile already exists
         if customer.get('profile'):
-            print(f"  Profile already exists, skipping...")
-            continue
+            print(f"Skipping {i}/{len(customers)}: {first_name} {last_name}, profile already exists")
+            return
         
         # Find person's data in profile book
-        person_profile_data = find_person_in_profile_book(first_name, last_name, profile_book_text)
+        person_profile_data = find_person_in_profile_book(first_name, last_name, profile_book_text, profile_book_text_lower, name_hits)
         
         # Generate profile using OpenAI
-        profile = generate_customer_profile(client, first_name, last_name, city, person_profile_data)
+        request = build_profile_request(first_name, last_name, city, person_profile_data)
+        try:
+            profile = await generate_with_retries(no_retry_client, semaphore, limiter, request)
+        except Exception as e:
+            print(f"Error generating profile for {first_name} {last_name}: {e}")
+            customer['profile'] = f"Error generating profile: {str(e)}"
+            return
         customer['profile'] = profile
+        save_profile_checkpoint(checkpoint, customer)
         
-        print(f"  Generated profile ({len(profile)} characters)")
-        
-        # Rate limiting - wait 1 second between API calls
-        time.sleep(1)
+        print(f"Processed {i}/{len(customers)}: {first_name} {last_name} from {city} ({len(profile)} characters)")
+    
+    with open(CHECKPOINT_FILE, 'a', encoding='utf-8') as checkpoint:
+        if args.batch:
+            # Submit every pending customer as one Batch API job
+            requests = {}
+            keys = {}
+            pending: Dict[Tuple[str, str, str], List[Dict]] = {}
+            for i, customer in enumerate(customers):
+                if customer.get('profile'):
+                    continue
+                first_name = customer.get('first_name', '')
+                last_name = customer.get('last_name', '')
+                city = customer.get('city', '')
+                person_profile_data = find_person_in_profile_book(first_name, last_name, profile_book_text, profile_book_text_lower, name_hits)
+                requests[f"row-{i}"] = build_profile_request(first_name, last_name, city, person_profile_data)
+                keys[f"row-{i}"] = checkpoint_key(customer)
+                pending.setdefault(checkpoint_key(customer), []).append(customer)
+            
+            if requests or os.path.exists(BATCH_STATE_FILE):
+                profiles, errors = await run_profile_batch(client, requests, keys)
+                for key, profile in profiles.items():
+                    for customer in pending.get(key, []):
+                        customer['profile'] = profile
+                        save_profile_checkpoint(checkpoint, customer)
+                for key, error in errors.items():
+                    for customer in pending.get(key, []):
+                        customer['profile'] = f"Error generating profile: {error}"
+                print(f"Generated {len(profiles)}/{len(profiles) + len(errors)} profiles via batch")
+        else:
+            # Generate profiles for all customers concurrently
+            await asyncio.gather(*[bounded(i, customer) for i, customer in enumerate(customers, 1)])
     
-    # Update Excel file with generated profiles
-    print("Updating Excel file...")
-    update_excel_with_profiles('nudge_customers.xlsx', customers)
+    if args.jsonl_out:
+        # Export to JSONL, skipping the openpyxl save entirely
+        print("Writing JSONL file...")
+        written = write_customers_jsonl(args.jsonl_out, customers)
+    else:
+        # Update Excel file with generated profiles
+        print("Updating Excel file...")
+        written = update_excel_with_profiles(wb, sheet, headers, customers, 'nudge_customers.xlsx')
+    
+    if not written:
+        print(f"Profile generation failed to save results; generated profiles are kept in {CHECKPOINT_FILE}")
+        sys.exit(1)
+    
+    # Results are saved, so the checkpoint is no longer needed and must not refill cells on later runs
+    if os.path.exists(CHECKPOINT_FILE):
+        os.remove(CHECKPOINT_FILE)
     
     print("Profile generation completed successfully!")
 
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Generate customer profiles using OpenAI.")
+    parser.add_argument('--batch', action='store_true',
+                        help="submit all prompts as a single OpenAI Batch API job (cheaper, completes within 24h)")
+    parser.add_argument('--fresh', action='store_true',
+                        help=f"discard profiles checkpointed in {CHECKPOINT_FILE} by an earlier interrupted run")
+    parser.add_argument('--jsonl-out', metavar='PATH',
+                        help="write customers with their profiles to this JSONL file instead of updating the Excel file")
+    args = parser.parse_args()
+    if args.jsonl_out and os.path.realpath(args.jsonl_out) == os.path.realpath(CHECKPOINT_FILE):
+        parser.error(f"--jsonl-out must not overwrite the checkpoint file {CHECKPOINT_FILE}")
+    return args
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main(parse_args()))